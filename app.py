@@ -1,10 +1,18 @@
+import hashlib
 import os
+import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from datetime import timedelta
+from cachetools import TLRUCache, TTLCache
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_session import Session
 from openai import OpenAI
-import json
+import orjson
 
 try:
     from dotenv import load_dotenv
@@ -12,34 +20,105 @@ try:
 except ImportError:
     pass
 
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process file locking
+    fcntl = None
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.permanent_session_lifetime = timedelta(hours=1)
 
-oauth_token_cache = {}
+# Keep session data (including the full analysis) server-side; the cookie
+# only carries the session ID. Uses Redis when REDIS_URL is set, otherwise
+# a local filesystem store.
+#
+# Analysis results from SSE streams are handed to /results through the same
+# backend, keyed by session ID. The session can't be written from inside a
+# streaming generator (it is saved before the body is sent), and /results
+# may be served by a different worker process than the stream. Results
+# nobody comes back for expire after 10 minutes.
+PENDING_ANALYSIS_TTL = 600  # seconds (10 minutes)
+if os.environ.get('REDIS_URL'):
+    import redis
+    from cachelib import RedisCache
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.from_url(os.environ['REDIS_URL'])
+    pending_analysis = RedisCache(
+        host=app.config['SESSION_REDIS'],
+        key_prefix='pending_analysis:',
+        default_timeout=PENDING_ANALYSIS_TTL
+    )
+else:
+    from cachelib import FileSystemCache
+    app.config['SESSION_TYPE'] = 'cachelib'
+    app.config['SESSION_CACHELIB'] = FileSystemCache(
+        os.path.join(os.path.dirname(__file__), '.flask_session'),
+        threshold=1000
+    )
+    pending_analysis = FileSystemCache(
+        os.path.join(os.path.dirname(__file__), '.pending_analysis'),
+        threshold=1000,
+        default_timeout=PENDING_ANALYSIS_TTL
+    )
+Session(app)
+
+# OAuth request secrets keyed by request token, as a fallback for when the
+# session cookie doesn't survive the round trip to Discogs. Abandoned logins
+# expire after 10 minutes instead of accumulating forever.
+oauth_token_cache = TTLCache(maxsize=10000, ttl=600)
+_oauth_token_cache_lock = threading.Lock()
 
 # Cache for fetched Discogs collections, keyed by username.
-# Each entry: {'data': [...], 'timestamp': float}
-collection_cache = {}
+# Each entry: {'data': [...], 'timestamp': float}. Entries expire
+# COLLECTION_CACHE_TTL seconds after their wall-clock timestamp, so entries
+# reloaded from disk keep their original expiry.
 COLLECTION_CACHE_TTL = 600  # seconds (10 minutes)
-
-# Temporary store for analysis results from SSE streams.
-# Flask's cookie-based session can't be written from inside a streaming
-# generator (headers are sent before the body), so we stash the result
-# here keyed by session ID and retrieve it in /results.
-pending_analysis = {}
+collection_cache = TLRUCache(
+    maxsize=256,
+    ttu=lambda username, entry, now: entry['timestamp'] + COLLECTION_CACHE_TTL,
+    timer=time.time
+)
+_collection_cache_lock = threading.RLock()
+
+# Cache for LLM analyses, keyed by a fingerprint of the collection contents.
+ANALYSIS_CACHE_TTL = 86400  # seconds (24 hours)
+analysis_cache = TTLCache(maxsize=1024, ttl=ANALYSIS_CACHE_TTL)
+_analysis_cache_lock = threading.Lock()
 
 DISCOGS_CONSUMER_KEY = os.environ.get('DISCOGS_CONSUMER_KEY')
 DISCOGS_CONSUMER_SECRET = os.environ.get('DISCOGS_CONSUMER_SECRET')
 DISCOGS_USER_AGENT = os.environ.get('DISCOGS_USER_AGENT', 'RecordCollectionAnalyzer/1.0')
 DISCOGS_CALLBACK_URL = os.environ.get('DISCOGS_CALLBACK_URL', 'http://localhost:5000/callback')
 
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
 def get_openai_client():
-    """Get or create OpenAI client."""
-    api_key = os.environ.get('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY environment variable is not set")
-    return OpenAI(api_key=api_key)
+    """Get or create the shared OpenAI client.
+
+    One client is reused for the life of the process so its connection pool
+    (and TLS sessions) stay warm between LLM calls.
+    """
+    global _openai_client
+    if _openai_client is None:
+        api_key = os.environ.get('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        with _openai_client_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(api_key=api_key)
+    return _openai_client
 
 def get_discogs_client():
     """Get Discogs client with user tokens if available."""
@@ -61,153 +140,379 @@ def get_discogs_client():
     except ImportError:
         raise ValueError("discogs-client library not installed. Run: pip install discogs-client")
 
-COLLECTION_CACHE_FILE = os.path.join(os.path.dirname(__file__), '.collection_cache.json')
+# Discogs allows 60 authenticated requests per minute. Collection pages are
+# fetched concurrently, so every Discogs call takes a token from a
+# process-wide bucket first. It refills at 55 per minute and holds at most 5,
+# so no 60-second window admits more than 60 requests.
+DISCOGS_RATE_LIMIT = 55  # requests per minute
+DISCOGS_RATE_BURST = 5
+DISCOGS_PAGE_SIZE = 100  # maximum per_page the Discogs API accepts
+DISCOGS_FETCH_WORKERS = 4
+
+MAX_COLLECTION_SIZE = 500
+
+class CollectionTooLargeError(ValueError):
+    """Raised when a collection has more albums than MAX_COLLECTION_SIZE."""
+
+    def __init__(self, size):
+        super().__init__(
+            f'Your collection has {size} albums. Collections over {MAX_COLLECTION_SIZE} albums are not currently supported.'
+        )
+
+_discogs_tokens = DISCOGS_RATE_BURST
+_discogs_tokens_updated = time.monotonic()
+_discogs_rate_lock = threading.Lock()
+
+def _wait_for_discogs_rate_limit():
+    """Block until the token bucket allows another Discogs request."""
+    global _discogs_tokens, _discogs_tokens_updated
+    while True:
+        with _discogs_rate_lock:
+            now = time.monotonic()
+            refill = (now - _discogs_tokens_updated) * DISCOGS_RATE_LIMIT / 60
+            _discogs_tokens = min(DISCOGS_RATE_BURST, _discogs_tokens + refill)
+            _discogs_tokens_updated = now
+            if _discogs_tokens >= 1:
+                _discogs_tokens -= 1
+                return
+            wait = (1 - _discogs_tokens) * 60 / DISCOGS_RATE_LIMIT
+        time.sleep(wait)
+
+def _iter_folder_releases(folder):
+    """Yield every item in a collection folder, fetching pages concurrently.
+
+    The first page is fetched on its own to learn the page count; the rest
+    are requested in parallel and yielded in order. Raises
+    CollectionTooLargeError before fetching more pages if the folder holds
+    over MAX_COLLECTION_SIZE releases.
+    """
+    releases = folder.releases
+    releases.per_page = DISCOGS_PAGE_SIZE
+
+    def fetch_page(index):
+        _wait_for_discogs_rate_limit()
+        return releases.page(index)
+
+    # Reading .pages loads (and keeps) page 1 along with the pagination info.
+    _wait_for_discogs_rate_limit()
+    num_pages = releases.pages
+    if releases.count > MAX_COLLECTION_SIZE:
+        raise CollectionTooLargeError(releases.count)
+    yield from releases.page(1)
+    if num_pages <= 1:
+        return
+
+    with ThreadPoolExecutor(max_workers=DISCOGS_FETCH_WORKERS) as executor:
+        for page in executor.map(fetch_page, range(2, num_pages + 1)):
+            yield from page
+
+# Append-only NDJSON mirror of the collection cache: one {'u': username,
+# 'data': [...], 'timestamp': float} record per write; the last record for a
+# username wins. Rewritten without stale records at startup and whenever it
+# grows past CACHE_FILE_COMPACT_RATIO records per live entry. Every gunicorn
+# worker shares the file, so writes hold an flock on a separate lock file.
+COLLECTION_CACHE_FILE = os.path.join(os.path.dirname(__file__), '.collection_cache.ndjson')
+COLLECTION_CACHE_LOCK_FILE = COLLECTION_CACHE_FILE + '.lock'
+CACHE_FILE_COMPACT_RATIO = 10
+
+_cache_file_lock = threading.Lock()
+_cache_file_records = 0
+
+@contextmanager
+def _locked_cache_file():
+    """Hold the cache file lock against other threads and worker processes."""
+    with _cache_file_lock, open(COLLECTION_CACHE_LOCK_FILE, 'ab') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
 
 def _load_cache_file():
-    """Load the on-disk collection cache."""
+    """Load the on-disk collection cache, keeping the latest record per username."""
+    cache = {}
     try:
-        with open(COLLECTION_CACHE_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-def _save_cache_file(cache):
-    """Write the collection cache to disk."""
-    with open(COLLECTION_CACHE_FILE, 'w') as f:
-        json.dump(cache, f)
+        with open(COLLECTION_CACHE_FILE, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # partial line from an interrupted write
+                cache[record.pop('u')] = record
+    except FileNotFoundError:
+        pass
+    return cache
+
+def _compact_cache_file():
+    """Rewrite the cache file with only unexpired entries and return them."""
+    now = time.time()
+    live = {
+        username: entry for username, entry in _load_cache_file().items()
+        if now - entry['timestamp'] < COLLECTION_CACHE_TTL
+    }
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(COLLECTION_CACHE_FILE), prefix='.collection_cache.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for username, entry in live.items():
+                f.write(orjson.dumps({'u': username, **entry}) + b'\n')
+        os.replace(tmp_path, COLLECTION_CACHE_FILE)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    return live
+
+def _append_cache_entry(username, entry):
+    """Append one entry to the on-disk cache (runs off the request path)."""
+    global _cache_file_records
+    with _locked_cache_file():
+        with open(COLLECTION_CACHE_FILE, 'ab') as f:
+            f.write(orjson.dumps({'u': username, **entry}) + b'\n')
+        _cache_file_records += 1
+        if _cache_file_records > CACHE_FILE_COMPACT_RATIO * max(len(collection_cache), 1):
+            _cache_file_records = len(_compact_cache_file())
+
+def _prime_collection_cache():
+    """Compact the disk cache and load its live entries into memory. Called once at startup."""
+    global _cache_file_records
+    try:
+        with _locked_cache_file():
+            live = _compact_cache_file()
+            _cache_file_records = len(live)
+    except OSError:
+        return  # start with an empty cache rather than fail to boot
+    with _collection_cache_lock:
+        collection_cache.update(live)
 
 def get_cached_collection(username):
     """Return cached collection data for username if fresh, else None."""
-    # Check in-memory first, then fall back to disk.
-    entry = collection_cache.get(username)
-    if not entry:
-        disk_cache = _load_cache_file()
-        entry = disk_cache.get(username)
-        if entry:
-            collection_cache[username] = entry  # promote to memory
-    if entry and (time.time() - entry['timestamp']) < COLLECTION_CACHE_TTL:
-        return entry['data']
-    return None
+    with _collection_cache_lock:
+        entry = collection_cache.get(username)
+    return entry['data'] if entry else None
 
 def set_cached_collection(username, data):
-    """Store collection data in the cache (memory + disk)."""
+    """Store collection data in memory and write it to disk in the background."""
     entry = {'data': data, 'timestamp': time.time()}
-    collection_cache[username] = entry
-    disk_cache = _load_cache_file()
-    disk_cache[username] = entry
-    _save_cache_file(disk_cache)
+    with _collection_cache_lock:
+        collection_cache[username] = entry
+    threading.Thread(target=_append_cache_entry, args=(username, entry), daemon=True).start()
+
+_prime_collection_cache()
+
+def _extract_album(data):
+    """Pull the fields the analysis uses out of a release's JSON data."""
+    artists = data.get('artists') or []
+    genres = data.get('genres') or []
+    styles = data.get('styles') or []
+    year = data.get('year')
+
+    return {
+        'artist': ', '.join(a['name'] for a in artists if a.get('name')) or 'Unknown Artist',
+        'album': data.get('title', ''),
+        'year': str(year) if year else '',
+        'genre': ', '.join(genres) or ', '.join(styles)
+    }
+
+def _iter_collection(user):
+    """Yield (count, album_info) for each album in the user's collection.
+
+    Releases that fail to parse are skipped and not counted.
+    """
+    try:
+        _wait_for_discogs_rate_limit()
+        folders = user.collection_folders
+    except Exception as e:
+        raise ValueError(f"Could not access collection folders: {str(e)}")
+
+    if not folders:
+        return
+
+    # Folder 0 is the "All" folder containing every release.
+    # Iterating all folders would double-count since other folders
+    # are subsets of "All".
+    count = 0
+    for item in _iter_folder_releases(folders[0]):
+        try:
+            album_info = _extract_album(item.release.data)
+        except Exception:
+            continue
+        count += 1
+        yield count, album_info
 
 def fetch_collection_from_discogs():
     """Fetch user's collection from Discogs API, using cache if available."""
     try:
         client = get_discogs_client()
+        _wait_for_discogs_rate_limit()
         user = client.identity()
 
         cached = get_cached_collection(user.username)
         if cached is not None:
             return cached, user.username
 
-        collection_data = []
-
-        try:
-            folders = user.collection_folders
-        except Exception as e:
-            raise ValueError(f"Could not access collection folders: {str(e)}")
-
-        if not folders or len(folders) == 0:
-            return [], user.username
-
-        # Folder 0 is the "All" folder containing every release.
-        # Iterating all folders would double-count since other folders
-        # are subsets of "All".
-        all_folder = folders[0]
-        releases = all_folder.releases
-
-        for item in releases:
-            try:
-                data = item.release.data
-
-                artists = [a['name'] for a in data.get('artists', [])] if data.get('artists') else []
-                artist_name = ', '.join(artists) if artists else 'Unknown Artist'
-
-                genres = data.get('genres', []) or []
-                genre = ', '.join(genres) if genres else ''
-
-                styles = data.get('styles', []) or []
-                style = ', '.join(styles) if styles else ''
-
-                labels = [l['name'] for l in data.get('labels', [])] if data.get('labels') else []
-                label_name = ', '.join(labels) if labels else ''
-
-                formats = []
-                for f in (data.get('formats', []) or []):
-                    if isinstance(f, dict):
-                        formats.append(f.get('name', ''))
-                format_str = ', '.join([f for f in formats if f]) if formats else ''
-
-                album_info = {
-                    'artist': artist_name,
-                    'album': data.get('title', ''),
-                    'label': label_name,
-                    'year': str(data.get('year', '')) if data.get('year') else '',
-                    'genre': genre or style,
-                    'format': format_str
-                }
-                collection_data.append(album_info)
-
-            except Exception:
-                continue
+        collection_data = [album_info for _, album_info in _iter_collection(user)]
 
         if collection_data:
             set_cached_collection(user.username, collection_data)
 
         return collection_data, user.username
 
+    except CollectionTooLargeError:
+        raise
     except Exception as e:
         raise ValueError(f"Error fetching collection from Discogs: {str(e)}")
 
-MAX_COLLECTION_SIZE = 500
+def _album_line(item):
+    """Format one album as a line of collection text."""
+    if item.get('year'):
+        return f"{item['artist']} - {item['album']} ({item['year']})"
+    return f"{item['artist']} - {item['album']}"
+
 
 def _build_collection_text(collection_data):
-    """Build the collection summary text for LLM prompts."""
+    """Build the collection summary text for LLM prompts.
+
+    Albums are grouped under their genre so each genre string is sent once
+    instead of on every line, preceded by a decade histogram.
+    """
     albums_to_analyze = collection_data[:MAX_COLLECTION_SIZE]
-    collection_summary = []
+
+    albums_by_genre = defaultdict(list)
     for item in albums_to_analyze:
-        summary_line = f"{item['artist']} - {item['album']}"
-        if item.get('year'):
-            summary_line += f" ({item['year']})"
-        if item.get('genre'):
-            summary_line += f" [{item['genre']}]"
-        collection_summary.append(summary_line)
+        albums_by_genre[item.get('genre') or 'Unknown genre'].append(item)
+
+    decade_counts = Counter(
+        int(item['year']) // 10 * 10
+        for item in albums_to_analyze
+        if item.get('year', '').isdigit()
+    )
+
+    collection_summary = []
+    if decade_counts:
+        decades = ', '.join(f"{decade}s: {count}" for decade, count in sorted(decade_counts.items()))
+        collection_summary.append(f"Decades: {decades}")
+
+    # Largest genres first.
+    for genre, items in sorted(albums_by_genre.items(), key=lambda kv: -len(kv[1])):
+        collection_summary.append(f"\n[{genre}] ({len(items)} albums)")
+        collection_summary.extend(map(_album_line, items))
     return "\n".join(collection_summary), len(albums_to_analyze)
 
 
-def _call_llm(prompt):
-    """Make a single LLM call and return parsed JSON."""
-    client = get_openai_client()
-    response = client.chat.completions.create(
-        model="gpt-5.4-mini",
-        messages=[
+# Structured output schema for the analysis. Strict mode guarantees every
+# top-level key is present, so _parse_analysis can't hit a KeyError on a
+# response the model cut short.
+ANALYSIS_RESPONSE_FORMAT = {
+    'type': 'json_schema',
+    'json_schema': {
+        'name': 'collection_analysis',
+        'strict': True,
+        'schema': {
+            'type': 'object',
+            'properties': {
+                'vibe_summary': {'type': 'string'},
+                'strengths': {'type': 'string'},
+                'taste_recommendations': {'type': 'array', 'items': {'type': 'string'}},
+                'growth_areas': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'title': {'type': 'string'},
+                            'description': {'type': 'string'},
+                            'recommendations': {'type': 'array', 'items': {'type': 'string'}},
+                        },
+                        'required': ['title', 'description', 'recommendations'],
+                        'additionalProperties': False,
+                    },
+                },
+            },
+            'required': ['vibe_summary', 'strengths', 'taste_recommendations', 'growth_areas'],
+            'additionalProperties': False,
+        },
+    },
+}
+
+def _partial_response_format(name, fields):
+    """Strict response format limited to some of the analysis's top-level fields."""
+    schema = ANALYSIS_RESPONSE_FORMAT['json_schema']['schema']
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': name,
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {field: schema['properties'][field] for field in fields},
+                'required': list(fields),
+                'additionalProperties': False,
+            },
+        },
+    }
+
+# Halves of the analysis for reports that defer growth areas to the Batch
+# API. Both use the full analysis prompt, so they share its cached prefix.
+OVERVIEW_RESPONSE_FORMAT = _partial_response_format(
+    'collection_overview', ('vibe_summary', 'strengths', 'taste_recommendations')
+)
+GROWTH_RESPONSE_FORMAT = _partial_response_format('collection_growth_areas', ('growth_areas',))
+
+def _chat_request(prompt, response_format=ANALYSIS_RESPONSE_FORMAT):
+    """Build the Chat Completions request body for an analysis prompt."""
+    return {
+        'model': "gpt-5.4-mini",
+        'messages': [
             {"role": "system", "content": "You are a knowledgeable music critic and collection analyst. Provide thoughtful, specific insights about record collections."},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.7,
-        response_format={"type": "json_object"}
-    )
-    return json.loads(response.choices[0].message.content)
+        'temperature': 0.7,
+        'response_format': response_format,
+    }
 
 
-def analyze_collection_with_llm(collection_data):
-    """Use OpenAI to analyze the collection and generate insights."""
-    collection_text, num_analyzed = _build_collection_text(collection_data)
+def _call_llm(prompt, response_format=ANALYSIS_RESPONSE_FORMAT):
+    """Make a single LLM call and return parsed JSON."""
+    client = get_openai_client()
+    response = client.chat.completions.create(**_chat_request(prompt, response_format))
+    return orjson.loads(response.choices[0].message.content)
+
+
+def _stream_llm(prompt):
+    """Make a streaming LLM call, yielding response text as it arrives."""
+    client = get_openai_client()
+    stream = client.chat.completions.create(**_chat_request(prompt), stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _collection_fingerprint(collection_data):
+    """Return an order-independent SHA-256 fingerprint of a collection."""
+    albums = sorted((item['artist'], item['album']) for item in collection_data)
+    return hashlib.sha256(orjson.dumps(albums)).hexdigest()
+
+
+def get_cached_analysis(fingerprint):
+    """Return the cached analysis for a collection fingerprint if fresh, else None."""
+    with _analysis_cache_lock:
+        return analysis_cache.get(fingerprint)
 
-    prompt = f"""You are a music collection analyst. Analyze the following record collection.
 
-Collection ({num_analyzed} albums):
-{collection_text}
+def set_cached_analysis(fingerprint, analysis):
+    """Store an analysis in the cache."""
+    with _analysis_cache_lock:
+        analysis_cache[fingerprint] = analysis
+
+
+# Static instructions first, collection last. On its own this prefix (~500
+# tokens) is below OpenAI's 1,024-token prompt-caching minimum, so it is not
+# cached across users. The ordering pays off when the overview and growth
+# halves of a deferred report send the same full prompt. Repeat reports for
+# one collection never reach OpenAI; analysis_cache answers them.
+ANALYSIS_PROMPT_PREFIX = """You are a music collection analyst. Analyze the record collection listed at the end of this message.
 
 Please provide a JSON response with the following structure:
-{{
+{
     "vibe_summary": "One paragraph describing the collection's overall vibe and point of view",
     "strengths": "One paragraph describing the strengths of this collection",
     "taste_recommendations": [
@@ -218,7 +523,7 @@ Please provide a JSON response with the following structure:
         "Album 5 - Artist 5"
     ],
     "growth_areas": [
-        {{
+        {
             "title": "2-5 word title",
             "description": "A paragraph explaining this area and why exploring it would enrich the collection",
             "recommendations": [
@@ -226,9 +531,9 @@ Please provide a JSON response with the following structure:
                 "Album - Artist",
                 "Album - Artist"
             ]
-        }}
+        }
     ]
-}}
+}
 
 INSTRUCTIONS:
 - "vibe_summary": Describe the overall personality and point of view of this collection.
@@ -240,25 +545,244 @@ INSTRUCTIONS:
   - Exactly 3 album recommendations for that area
 
 CRITICAL — RECOMMENDATION EXCLUSION RULE (DO NOT VIOLATE):
-Every recommended album MUST NOT already appear in the collection listed above. Before finalizing your response, cross-check EVERY recommendation against the full collection list. If an album or artist/album pair is already in the collection, replace it with a different one. Recommending an album the user already owns destroys trust and is the single worst mistake you can make. All recommendations must be unique (no duplicates).
+Every recommended album MUST NOT already appear in the collection listed below. Before finalizing your response, cross-check EVERY recommendation against the full collection list. If an album or artist/album pair is already in the collection, replace it with a different one. Recommending an album the user already owns destroys trust and is the single worst mistake you can make. All recommendations must be unique (no duplicates).
+
+Be specific and insightful. Reference specific artists, genres, or eras when relevant.
+
+"""
+
 
-Be specific and insightful. Reference specific artists, genres, or eras when relevant."""
+def _build_analysis_prompt(collection_data):
+    """Build the analysis prompt for a collection."""
+    collection_text, num_analyzed = _build_collection_text(collection_data)
+    return ANALYSIS_PROMPT_PREFIX + f"Collection ({num_analyzed} albums):\n" + collection_text
+
+
+def _parse_analysis(analysis):
+    """Pick the report fields out of the LLM's JSON response."""
+    return {
+        'vibe_summary': analysis['vibe_summary'],
+        'strengths': analysis['strengths'],
+        'taste_recommendations': analysis['taste_recommendations'],
+        'growth_areas': analysis['growth_areas'],
+    }
+
+
+# Analyses currently being generated, keyed by collection fingerprint.
+# Concurrent requests for the same collection (e.g. a double-click) wait on
+# the first request's Future instead of making their own LLM call.
+_inflight_analyses = {}
+_inflight_lock = threading.Lock()
+
+def _claim_analysis(fingerprint):
+    """Join the in-flight analysis for a fingerprint, or register a new one.
+
+    Returns (future, is_owner). The owner must resolve the future with
+    _settle_analysis; everyone else waits on future.result().
+    """
+    with _inflight_lock:
+        future = _inflight_analyses.get(fingerprint)
+        if future is not None:
+            return future, False
+        future = Future()
+        _inflight_analyses[fingerprint] = future
+        return future, True
+
+
+def _settle_analysis(fingerprint, future, result=None, error=None):
+    """Hand the owner's outcome to any waiters and free the in-flight slot."""
+    with _inflight_lock:
+        _inflight_analyses.pop(fingerprint, None)
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+@contextmanager
+def _analysis_flight(fingerprint):
+    """Make at most one LLM call per collection fingerprint at a time.
+
+    Yields (result, settle). When result is set it is the cached analysis,
+    or the outcome of another request's call for the same collection, and
+    the caller should return it. Otherwise the caller owns the call and
+    passes its parsed analysis to settle(), which caches it and wakes any
+    waiters. An exception raised in the block is handed to the waiters too.
+    """
+    cached = get_cached_analysis(fingerprint)
+    if cached is not None:
+        yield cached, None
+        return
+
+    future, is_owner = _claim_analysis(fingerprint)
+    if not is_owner:
+        yield future.result(), None
+        return
+
+    # A previous owner may have cached its result and released the slot
+    # between our cache check and the claim.
+    cached = get_cached_analysis(fingerprint)
+    if cached is not None:
+        _settle_analysis(fingerprint, future, cached)
+        yield cached, None
+        return
+
+    def settle(result):
+        set_cached_analysis(fingerprint, result)
+        _settle_analysis(fingerprint, future, result)
 
     try:
-        analysis = _call_llm(prompt)
+        yield None, settle
+    except Exception as e:
+        error = ValueError(f"Error calling LLM: {str(e)}")
+        _settle_analysis(fingerprint, future, error=error)
+        raise error
+    except BaseException:
+        # Includes GeneratorExit when a streaming client disconnects.
+        _settle_analysis(fingerprint, future, error=ValueError("Analysis was interrupted"))
+        raise
 
-        return {
-            'vibe_summary': analysis['vibe_summary'],
-            'strengths': analysis['strengths'],
-            'taste_recommendations': analysis['taste_recommendations'],
-            'growth_areas': analysis['growth_areas'],
-        }
+
+def analyze_collection_with_llm(collection_data):
+    """Use OpenAI to analyze the collection and generate insights."""
+    with _analysis_flight(_collection_fingerprint(collection_data)) as (result, settle):
+        if settle is None:
+            return result
+        result = _parse_analysis(_call_llm(_build_analysis_prompt(collection_data)))
+        settle(result)
+    return result
+
+
+def stream_collection_analysis(collection_data):
+    """Streaming variant of analyze_collection_with_llm.
+
+    Yields the raw response text as the model writes it; the parsed analysis
+    is the generator's return value. Requests that join an analysis already
+    in flight get no text, only the result.
+    """
+    with _analysis_flight(_collection_fingerprint(collection_data)) as (result, settle):
+        if settle is None:
+            return result
+        response_parts = []
+        for delta in _stream_llm(_build_analysis_prompt(collection_data)):
+            response_parts.append(delta)
+            yield delta
+        result = _parse_analysis(orjson.loads(''.join(response_parts)))
+        settle(result)
+    return result
+
+
+# Batch API jobs that are still running. Anything else (failed, expired,
+# cancelled) is terminal.
+BATCH_PENDING_STATUSES = ('validating', 'in_progress', 'finalizing')
+
+def submit_analysis_batch(collection_data, response_format=ANALYSIS_RESPONSE_FORMAT):
+    """Queue the analysis through the OpenAI Batch API and return the batch ID.
+
+    Batch requests cost about half as much as synchronous ones but can take
+    up to 24 hours to complete.
+    """
+    request_line = orjson.dumps({
+        'custom_id': _collection_fingerprint(collection_data),
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': _chat_request(_build_analysis_prompt(collection_data), response_format),
+    })
+
+    try:
+        client = get_openai_client()
+        batch_file = client.files.create(
+            file=('analysis.jsonl', request_line),
+            purpose='batch'
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
+        )
+        return batch.id
+    except Exception as e:
+        raise ValueError(f"Error queuing report: {str(e)}")
+
+
+def _retrieve_batch_output(batch_id):
+    """Return (collection fingerprint, parsed JSON) for a finished batch.
+
+    Returns None while the batch is still running.
+    """
+    try:
+        client = get_openai_client()
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in BATCH_PENDING_STATUSES:
+            return None
+        if batch.status != 'completed' or not batch.output_file_id:
+            raise ValueError(f"batch {batch.status}")
+
+        output = client.files.content(batch.output_file_id).text
+        record = orjson.loads(output.splitlines()[0])
+        content = record['response']['body']['choices'][0]['message']['content']
+        return record['custom_id'], orjson.loads(content)
+    except Exception as e:
+        raise ValueError(f"Error retrieving queued report: {str(e)}")
+
+
+def get_batch_analysis(batch_id):
+    """Return the analysis for a finished batch, or None while it is still running."""
+    output = _retrieve_batch_output(batch_id)
+    if output is None:
+        return None
+
+    fingerprint, response = output
+    result = _parse_analysis(response)
+    set_cached_analysis(fingerprint, result)
+    return result
+
+
+def analyze_overview_with_llm(collection_data):
+    """Run just the overview half of the analysis; growth_areas is left empty."""
+    try:
+        overview = _call_llm(_build_analysis_prompt(collection_data), OVERVIEW_RESPONSE_FORMAT)
+    except Exception as e:
+        raise ValueError(f"Error calling LLM: {str(e)}")
+
+    return {
+        'vibe_summary': overview['vibe_summary'],
+        'strengths': overview['strengths'],
+        'taste_recommendations': overview['taste_recommendations'],
+        'growth_areas': [],
+    }
+
+
+def analyze_growth_with_llm(collection_data, analysis):
+    """Generate growth areas synchronously and attach them to an overview-only analysis."""
+    try:
+        growth = _call_llm(_build_analysis_prompt(collection_data), GROWTH_RESPONSE_FORMAT)
     except Exception as e:
         raise ValueError(f"Error calling LLM: {str(e)}")
 
+    result = dict(analysis, growth_areas=growth['growth_areas'])
+    set_cached_analysis(_collection_fingerprint(collection_data), result)
+    return result
+
+
+def attach_batch_growth_areas(batch_id, analysis):
+    """Fill in growth areas from a finished growth batch.
+
+    Returns the completed analysis (also cached as a full analysis), or None
+    while the batch is still running.
+    """
+    output = _retrieve_batch_output(batch_id)
+    if output is None:
+        return None
+
+    fingerprint, response = output
+    result = dict(analysis, growth_areas=response['growth_areas'])
+    set_cached_analysis(fingerprint, result)
+    return result
+
 @app.route('/')
 def index():
-    """Main page with Discogs login or file upload."""
+    """Main page with Discogs login."""
     is_authenticated = bool(session.get('discogs_token') and session.get('discogs_token_secret'))
     username = session.get('discogs_username', '')
     return render_template('index.html', is_authenticated=is_authenticated, username=username)
@@ -281,10 +805,10 @@ def login():
         session['discogs_request_token'] = request_token
         session['discogs_request_secret'] = request_secret
         
-        oauth_token_cache[request_token] = {
-            'request_secret': request_secret,
-            'timestamp': time.time()
-        }
+        with _oauth_token_cache_lock:
+            oauth_token_cache[request_token] = {
+                'request_secret': request_secret
+            }
         
         session.modified = True
         
@@ -312,11 +836,11 @@ def callback():
         
         if not request_token or not request_secret:
             if oauth_token:
-                cached_data = oauth_token_cache.get(oauth_token)
+                with _oauth_token_cache_lock:
+                    cached_data = oauth_token_cache.pop(oauth_token, None)
                 if cached_data:
                     request_token = oauth_token
                     request_secret = cached_data['request_secret']
-                    oauth_token_cache.clear()
         
         if not request_token or not request_secret:
             return render_template('error.html', message='Session expired. Please try logging in again.'), 400
@@ -348,6 +872,7 @@ def callback():
         
         client.set_token(access_token, access_secret)
         try:
+            _wait_for_discogs_rate_limit()
             user = client.identity()
             session['discogs_username'] = user.username
         except Exception:
@@ -392,7 +917,28 @@ def generate_report():
                 'error': f'Your collection has {len(collection_data)} albums. Collections over {MAX_COLLECTION_SIZE} albums are not currently supported.'
             }), 400
 
-        analysis = analyze_collection_with_llm(collection_data)
+        # With defer_growth, only the overview runs now; the growth areas go
+        # through the Batch API at half the cost and are picked up later via
+        # /growth-status.
+        defer_growth = bool((request.get_json(silent=True) or {}).get('defer_growth'))
+        fingerprint = _collection_fingerprint(collection_data)
+        # A live report supersedes any queued one.
+        session.pop('analysis_batch_id', None)
+        session.pop('analysis_batch_size', None)
+        session.pop('growth_batch_id', None)
+        session.pop('growth_error', None)
+        session.pop('growth_fingerprint', None)
+        if defer_growth and get_cached_analysis(fingerprint) is None:
+            analysis = analyze_overview_with_llm(collection_data)
+            # /retry-growth only completes this overview for the same collection.
+            session['growth_fingerprint'] = fingerprint
+            try:
+                session['growth_batch_id'] = submit_analysis_batch(collection_data, GROWTH_RESPONSE_FORMAT)
+            except ValueError as e:
+                # Keep the overview; the results page offers a retry.
+                session['growth_error'] = str(e)
+        else:
+            analysis = analyze_collection_with_llm(collection_data)
         
         session['analysis'] = analysis
         session['collection_size'] = len(collection_data)
@@ -400,7 +946,8 @@ def generate_report():
         return jsonify({
             'success': True,
             'analysis': analysis,
-            'collection_size': len(collection_data)
+            'collection_size': len(collection_data),
+            'growth_pending': 'growth_batch_id' in session
         })
     
     except ValueError as e:
@@ -408,20 +955,86 @@ def generate_report():
     except Exception as e:
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
+@app.route('/generate-report-async', methods=['POST'])
+def generate_report_async():
+    """Queue a lower-cost report through the OpenAI Batch API."""
+    if not session.get('discogs_token') or not session.get('discogs_token_secret'):
+        return jsonify({'error': 'Not authenticated with Discogs'}), 401
+
+    try:
+        collection_data, username = fetch_collection_from_discogs()
+
+        if not collection_data:
+            return jsonify({
+                'error': 'No collection data found. Your Discogs collection appears to be empty, or there was an issue accessing it.'
+            }), 400
+
+        if len(collection_data) > MAX_COLLECTION_SIZE:
+            return jsonify({
+                'error': f'Your collection has {len(collection_data)} albums. Collections over {MAX_COLLECTION_SIZE} albums are not currently supported.'
+            }), 400
+
+        # Nothing to queue if this collection was analyzed recently.
+        cached = get_cached_analysis(_collection_fingerprint(collection_data))
+        if cached is not None:
+            session['analysis'] = cached
+            session['collection_size'] = len(collection_data)
+            session.pop('analysis_batch_id', None)
+            session.pop('growth_batch_id', None)
+            session.pop('growth_error', None)
+            session.pop('growth_fingerprint', None)
+            return jsonify({'success': True, 'queued': False})
+
+        batch_id = submit_analysis_batch(collection_data)
+        session['analysis_batch_id'] = batch_id
+        session['analysis_batch_size'] = len(collection_data)
+        session.pop('growth_batch_id', None)
+        session.pop('growth_error', None)
+        session.pop('growth_fingerprint', None)
+
+        return jsonify({'success': True, 'queued': True, 'batch_id': batch_id})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+
+# Pre-encoded SSE framing; only the JSON payload is serialized per event.
+SSE_STATUS_PREFIX = b"event: status\ndata: "
+SSE_ERROR_PREFIX = b"event: error_msg\ndata: "
+SSE_TOKEN_PREFIX = b"event: token\ndata: "
+SSE_EVENT_END = b"\n\n"
+SSE_COMPLETE_EVENT = b"event: complete\ndata: {}\n\n"
+
 @app.route('/generate-report-stream')
 def generate_report_stream():
     """Stream report generation progress via Server-Sent Events."""
     def event_stream():
         def send_status(step, message):
-            data = json.dumps({'step': step, 'message': message})
-            return f"event: status\ndata: {data}\n\n"
+            return SSE_STATUS_PREFIX + orjson.dumps({'step': step, 'message': message}) + SSE_EVENT_END
 
         def send_error(message):
-            data = json.dumps({'message': message})
-            return f"event: error_msg\ndata: {data}\n\n"
+            return SSE_ERROR_PREFIX + orjson.dumps({'message': message}) + SSE_EVENT_END
+
+        def send_token(text):
+            return SSE_TOKEN_PREFIX + orjson.dumps({'text': text}) + SSE_EVENT_END
 
         def send_complete():
-            return "event: complete\ndata: {}\n\n"
+            return SSE_COMPLETE_EVENT
+
+        def forward_tokens(analysis_stream):
+            """Relay streamed LLM text as token events; return the parsed analysis."""
+            try:
+                while True:
+                    try:
+                        delta = next(analysis_stream)
+                    except StopIteration as stop:
+                        return stop.value
+                    yield send_token(delta)
+            finally:
+                # On client disconnect, release the in-flight analysis now
+                # rather than whenever the generator is garbage collected.
+                analysis_stream.close()
 
         # Step 1: Connect to Discogs
         yield send_status('step-connect', 'Connecting to Discogs...')
@@ -432,6 +1045,7 @@ def generate_report_stream():
 
         try:
             client = get_discogs_client()
+            _wait_for_discogs_rate_limit()
             user = client.identity()
         except Exception as e:
             yield send_error(f'Failed to connect to Discogs: {str(e)}')
@@ -451,66 +1065,11 @@ def generate_report_stream():
 
             try:
                 collection_data = []
-                try:
-                    folders = user.collection_folders
-                except Exception as e:
-                    yield send_error(f'Could not access collection folders: {str(e)}')
-                    return
-
-                if not folders or len(folders) == 0:
-                    yield send_error('Your Discogs collection appears to be empty.')
-                    return
-
-                # Folder 0 is the "All" folder containing every release.
-                # Iterating all folders would double-count since other folders
-                # are subsets of "All".
-                all_folder = folders[0]
-
-                album_count = 0
-                try:
-                    releases = all_folder.releases
-                except Exception as e:
-                    yield send_error(f'Could not access collection releases: {str(e)}')
-                    return
-
-                for item in releases:
-                    try:
-                        data = item.release.data
-
-                        artists = [a['name'] for a in data.get('artists', [])] if data.get('artists') else []
-                        artist_name = ', '.join(artists) if artists else 'Unknown Artist'
-
-                        genres = data.get('genres', []) or []
-                        genre = ', '.join(genres) if genres else ''
-
-                        styles = data.get('styles', []) or []
-                        style = ', '.join(styles) if styles else ''
-
-                        labels = [l['name'] for l in data.get('labels', [])] if data.get('labels') else []
-                        label_name = ', '.join(labels) if labels else ''
-
-                        formats = []
-                        for f in (data.get('formats', []) or []):
-                            if isinstance(f, dict):
-                                formats.append(f.get('name', ''))
-                        format_str = ', '.join([f for f in formats if f]) if formats else ''
-
-                        album_info = {
-                            'artist': artist_name,
-                            'album': data.get('title', ''),
-                            'label': label_name,
-                            'year': str(data.get('year', '')) if data.get('year') else '',
-                            'genre': genre or style,
-                            'format': format_str
-                        }
-                        collection_data.append(album_info)
-                        album_count += 1
-
-                        if album_count % 10 == 0:
-                            yield send_status('step-fetch', f'Fetching collection... {album_count} albums found')
-
-                    except Exception:
-                        continue
+                for album_count, album_info in _iter_collection(user):
+                    collection_data.append(album_info)
+                    # Items arrive a page at a time, so report once per page.
+                    if album_count % DISCOGS_PAGE_SIZE == 0:
+                        yield send_status('step-fetch', f'Fetching collection... {album_count} albums found')
 
                 if not collection_data:
                     yield send_error('No albums found in your collection.')
@@ -523,13 +1082,16 @@ def generate_report_stream():
                 set_cached_collection(user.username, collection_data)
                 yield send_status('step-analyze', f'Analyzing {len(collection_data)} albums with AI...')
 
+            except CollectionTooLargeError as e:
+                yield send_error(str(e))
+                return
             except Exception as e:
                 yield send_error(f'Error fetching collection: {str(e)}')
                 return
 
-        # Step 3: LLM analysis
+        # Step 3: LLM analysis, forwarding the response as it streams in
         try:
-            analysis = analyze_collection_with_llm(collection_data)
+            analysis = yield from forward_tokens(stream_collection_analysis(collection_data))
         except Exception as e:
             yield send_error(f'Error during analysis: {str(e)}')
             return
@@ -537,12 +1099,11 @@ def generate_report_stream():
         # Step 4: Save and complete
         yield send_status('step-done', 'Building your report...')
         # Can't write session from inside a streaming generator (headers
-        # already sent), so stash in server-side dict for /results to pick up.
-        sid = session.get('discogs_token', 'anon')
-        pending_analysis[sid] = {
+        # already sent), so stash in the shared store for /results to pick up.
+        pending_analysis.set(session.sid, {
             'analysis': analysis,
             'collection_size': len(collection_data),
-        }
+        })
 
         yield send_complete()
 
@@ -553,14 +1114,38 @@ def generate_report_stream():
 def results():
     """Display analysis results."""
     # Retrieve analysis from server-side store (written by SSE stream) or session fallback.
-    sid = session.get('discogs_token', 'anon')
-    pending = pending_analysis.pop(sid, None)
+    pending = pending_analysis.get(session.sid)
     if pending:
+        pending_analysis.delete(session.sid)
         analysis = pending['analysis']
         collection_size = pending['collection_size']
         # Persist into session for page refreshes.
         session['analysis'] = analysis
         session['collection_size'] = collection_size
+        session.pop('growth_batch_id', None)
+        session.pop('growth_error', None)
+        session.pop('growth_fingerprint', None)
+        session.pop('analysis_batch_id', None)
+        session.pop('analysis_batch_size', None)
+    elif session.get('analysis_batch_id'):
+        # Queued report: check on the Batch API job.
+        try:
+            analysis = get_batch_analysis(session['analysis_batch_id'])
+        except ValueError as e:
+            session.pop('analysis_batch_id', None)
+            session.pop('analysis_batch_size', None)
+            return render_template('error.html', message=str(e)), 500
+
+        if analysis is None:
+            return render_template('error.html', title='Your report is still being prepared',
+                                   message='Queued reports can take a while to finish. Check back on this page later.'), 202
+
+        collection_size = session.pop('analysis_batch_size', 0)
+        session.pop('analysis_batch_id', None)
+        session.pop('growth_error', None)
+        session.pop('growth_fingerprint', None)
+        session['analysis'] = analysis
+        session['collection_size'] = collection_size
     else:
         analysis = session.get('analysis')
         collection_size = session.get('collection_size', 0)
@@ -572,7 +1157,75 @@ def results():
     if 'growth_areas' not in analysis:
         return redirect(url_for('index'))
 
-    return render_template('results.html', analysis=analysis, collection_size=collection_size)
+    return render_template('results.html', analysis=analysis, collection_size=collection_size,
+                           growth_pending=bool(session.get('growth_batch_id')),
+                           growth_error=session.get('growth_error'))
+
+@app.route('/growth-status')
+def growth_status():
+    """Check on deferred growth areas, attaching them to the report once ready."""
+    batch_id = session.get('growth_batch_id')
+    analysis = session.get('analysis')
+    if not batch_id or not analysis:
+        return jsonify({'status': 'none'})
+
+    try:
+        completed = attach_batch_growth_areas(batch_id, analysis)
+    except ValueError as e:
+        # Keep the failure in the session so /results can offer a retry.
+        session.pop('growth_batch_id', None)
+        session['growth_error'] = str(e)
+        return jsonify({'status': 'failed', 'error': str(e)}), 500
+
+    if completed is None:
+        return jsonify({'status': 'pending'})
+
+    session['analysis'] = completed
+    session.pop('growth_batch_id', None)
+    session.pop('growth_fingerprint', None)
+    return jsonify({'status': 'completed', 'growth_areas': completed['growth_areas']})
+
+@app.route('/retry-growth', methods=['POST'])
+def retry_growth():
+    """Generate growth areas synchronously after the queued job failed."""
+    if not session.get('discogs_token') or not session.get('discogs_token_secret'):
+        return jsonify({'error': 'Not authenticated with Discogs'}), 401
+
+    analysis = session.get('analysis')
+    if not analysis:
+        return jsonify({'error': 'No analysis found. Please generate a report first.'}), 400
+
+    try:
+        collection_data, username = fetch_collection_from_discogs()
+
+        if not collection_data:
+            return jsonify({
+                'error': 'No collection data found. Your Discogs collection appears to be empty, or there was an issue accessing it.'
+            }), 400
+
+        if len(collection_data) > MAX_COLLECTION_SIZE:
+            return jsonify({
+                'error': f'Your collection has {len(collection_data)} albums. Collections over {MAX_COLLECTION_SIZE} albums are not currently supported.'
+            }), 400
+
+        # The overview was written for the collection as it was then; don't
+        # pair it with growth areas (or cache it) for a changed collection.
+        if _collection_fingerprint(collection_data) != session.get('growth_fingerprint'):
+            return jsonify({
+                'error': 'Your collection has changed since this report was generated. Please generate a new report.'
+            }), 409
+
+        completed = analyze_growth_with_llm(collection_data, analysis)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+
+    session['analysis'] = completed
+    session.pop('growth_batch_id', None)
+    session.pop('growth_error', None)
+    session.pop('growth_fingerprint', None)
+    return jsonify({'success': True, 'growth_areas': completed['growth_areas']})
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,19 @@
+"""Gunicorn settings for running Vinyl Reporter in production.
+
+Report generation spends nearly all of its time waiting on Discogs and
+OpenAI, so gevent workers are used: each worker process serves many
+concurrent requests (including long-lived SSE streams) as greenlets instead
+of one request at a time. The gevent worker monkey-patches the standard
+library before the app is imported, so requests, httpx and the Discogs page
+fetch threads all yield cooperatively.
+
+One worker is the default. The Discogs rate limiter and the in-memory
+caches are per process, so each extra worker (WEB_CONCURRENCY) adds another
+60 requests/minute of Discogs budget beyond what Discogs allows.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = 'gevent'
+worker_connections = 100